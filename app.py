@@ -3,6 +3,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import sqlite3
 import contextlib
+import threading
 from functools import wraps
 
 app = Flask(__name__)
@@ -62,6 +63,171 @@ def atividade_ativa_maquina(id_maquina):
         return True, atividade
     return False, None
 
+# Estatísticas de ciclo em tempo real
+# Média/variância (Welford) e média móvel exponencial (EWMA) do tempo de ciclo,
+# gravadas por máquina como snapshot no banco. O snapshot é lido a cada ciclo
+# (uma linha pela chave primária), o que vale também com vários processos.
+
+ALFA_EWMA = 0.2              # peso do ciclo mais recente na média móvel
+TOLERANCIA_LENTIDAO = 1.2    # alerta quando a EWMA passa 20% do tempo alvo
+MIN_CICLOS_ALERTA = 5        # ciclos mínimos antes de avaliar lentidão
+
+def carregar_estatisticas_ciclo(conn, id_maquina, atividade):
+    snapshot = conn.execute('''
+        SELECT * FROM estatisticas_ciclo
+        WHERE id_maquina = ? AND id_atividade = ?
+    ''', (id_maquina, atividade['id_atividade'])).fetchone()
+
+    if snapshot:
+        return {
+            'id_atividade': snapshot['id_atividade'],
+            'ciclos': snapshot['ciclos'],
+            'media': snapshot['media'],
+            'm2': snapshot['m2'],
+            'ewma': snapshot['ewma'],
+            'ultimo_ciclo': datetime.strptime(snapshot['ultimo_ciclo'], "%Y-%m-%d %H:%M:%S"),
+            'em_alerta': bool(snapshot['em_alerta'])
+        }
+
+    # Sem ciclo anterior: o primeiro ciclo informado só marca o ponto de partida
+    # (o intervalo desde o início da atividade inclui preparação, não é um ciclo)
+    return {
+        'id_atividade': atividade['id_atividade'],
+        'ciclos': 0,
+        'media': 0.0,
+        'm2': 0.0,
+        'ewma': None,
+        'ultimo_ciclo': None,
+        'em_alerta': False
+    }
+
+def atualizar_estatisticas_ciclo(estado, tempo_ciclo):
+    estado['ciclos'] += 1
+    delta = tempo_ciclo - estado['media']
+    estado['media'] += delta / estado['ciclos']
+    estado['m2'] += delta * (tempo_ciclo - estado['media'])
+
+    if estado['ewma'] is None:
+        estado['ewma'] = tempo_ciclo
+    else:
+        estado['ewma'] = ALFA_EWMA * tempo_ciclo + (1 - ALFA_EWMA) * estado['ewma']
+
+def desvio_padrao_ciclo(estado):
+    if estado['ciclos'] < 2:
+        return None
+    return (estado['m2'] / (estado['ciclos'] - 1)) ** 0.5
+
+def tempo_alvo_ciclo(meta_hora):
+    # Tempo de ciclo implícito na meta por hora (segundos por ciclo)
+    try:
+        meta = float(meta_hora)
+    except (TypeError, ValueError):
+        return None
+    return 3600 / meta if meta > 0 else None
+
+def gravar_estatisticas_ciclo(conn, id_maquina, estado):
+    conn.execute('''
+        INSERT OR REPLACE INTO estatisticas_ciclo
+            (id_maquina, id_atividade, ciclos, media, m2, ewma, ultimo_ciclo, em_alerta)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        id_maquina, estado['id_atividade'], estado['ciclos'], estado['media'], estado['m2'],
+        estado['ewma'], estado['ultimo_ciclo'].strftime('%Y-%m-%d %H:%M:%S'), int(estado['em_alerta'])
+    ))
+
+# Cache de fragmentos das listagens administrativas
+# Cada tabela tem um contador de versão no banco (versoes_tabelas), incrementado
+# pelas rotas de cadastro, edição e exclusão na mesma transação da alteração.
+# A versão faz parte da chave, então todos os processos deixam de usar os
+# fragmentos antigos, que saem do cache pelo limite de tamanho.
+
+ITENS_POR_PAGINA = 50
+MAX_FRAGMENTOS = 200
+
+LISTAGENS = {
+    'maquinas': {
+        'template': 'tabela_maquinas.html',
+        'rota': 'cadastrar_maquina',
+        'campos': '*',
+        'busca': ('id_maquina', 'nome_maquina', 'setor'),
+        'ordem': 'setor, nome_maquina'
+    },
+    'usuarios': {
+        'template': 'tabela_usuarios.html',
+        'rota': 'cadastrar_usuario',
+        'campos': 'matricula, nome, perfil',
+        'busca': ('matricula', 'nome', 'perfil'),
+        'ordem': 'matricula'
+    }
+}
+
+cache_fragmentos = {}
+trava_fragmentos = threading.Lock()
+
+def incrementar_versao_tabela(conn, tabela):
+    conn.execute('''
+        INSERT INTO versoes_tabelas (tabela, versao) VALUES (?, 1)
+        ON CONFLICT(tabela) DO UPDATE SET versao = versao + 1
+    ''', (tabela,))
+
+def versao_tabela(conn, tabela):
+    registro = conn.execute('SELECT versao FROM versoes_tabelas WHERE tabela = ?', (tabela,)).fetchone()
+    return registro['versao'] if registro else 0
+
+def parametros_listagem():
+    busca = request.args.get('busca', '').strip()
+    try:
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+    except ValueError:
+        pagina = 1
+    return busca, pagina
+
+def fragmento_tabela(tabela, busca, pagina):
+    conn = get_db_connection()
+    chave = (tabela, versao_tabela(conn, tabela), busca, pagina)
+    with trava_fragmentos:
+        fragmento = cache_fragmentos.get(chave)
+    if fragmento is not None:
+        conn.close()
+        return fragmento
+
+    listagem = LISTAGENS[tabela]
+    # % e _ digitados na busca são procurados literalmente
+    termo = busca.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    filtro = ' OR '.join(f"{coluna} LIKE ? ESCAPE '\\'" for coluna in listagem['busca'])
+    parametros = (f'%{termo}%',) * len(listagem['busca'])
+    campos, ordem = listagem['campos'], listagem['ordem']
+
+    total = conn.execute(f'SELECT COUNT(*) AS count FROM {tabela} WHERE {filtro}', parametros).fetchone()['count']
+    total_paginas = max((total + ITENS_POR_PAGINA - 1) // ITENS_POR_PAGINA, 1)
+    pagina = min(pagina, total_paginas)
+    registros = conn.execute(f'''
+        SELECT {campos} FROM {tabela}
+        WHERE {filtro}
+        ORDER BY {ordem}
+        LIMIT ? OFFSET ?
+    ''', parametros + (ITENS_POR_PAGINA, (pagina - 1) * ITENS_POR_PAGINA)).fetchall()
+    conn.close()
+
+    fragmento = render_template(
+        listagem['template'],
+        registros=registros,
+        rota=listagem['rota'],
+        busca=busca,
+        pagina=pagina,
+        total_paginas=total_paginas
+    )
+
+    # Descarta o fragmento mais antigo quando o cache atinge o limite
+    with trava_fragmentos:
+        if chave not in cache_fragmentos and len(cache_fragmentos) >= MAX_FRAGMENTOS:
+            cache_fragmentos.pop(next(iter(cache_fragmentos)), None)
+        cache_fragmentos[chave] = fragmento
+    return fragmento
+
+def requisicao_parcial():
+    return request.headers.get('X-Requested-With') == 'fetch'
+
 
 # Login
 
@@ -130,34 +296,42 @@ def cadastrar_usuario():
         return redirect(url_for('pagina_inicial'))
 
     mensagem = None
-    conn = get_db_connection()
 
     if request.method == 'POST':
         matricula = request.form['matricula']
         nome = request.form['nome']
         senha_pura = request.form['senha']
-        confirmar_senha = request.form['confirmar_senha']        
+        confirmar_senha = request.form['confirmar_senha']
         perfil = request.form['perfil']
         data_cadastro = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         responsavel = session.get('usuario_logado')
+        linha = None
 
         if senha_pura != confirmar_senha:
             mensagem = "As senhas não coincidem."
         else:
             senha_hash = generate_password_hash(senha_pura)
+            conn = get_db_connection()
             try:
                 conn.execute('''
                     INSERT INTO usuarios (matricula, nome, senha, perfil, data_cadastro, usuario_responsavel)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (matricula, nome, senha_hash, perfil, data_cadastro, responsavel))
+                incrementar_versao_tabela(conn, 'usuarios')
                 conn.commit()
                 mensagem = "Usuário cadastrado com sucesso!"
+                linha = render_template('linha_usuario.html', usuario={'matricula': matricula, 'nome': nome, 'perfil': perfil})
             except sqlite3.IntegrityError:
                 mensagem = "Matrícula já cadastrada."
+            conn.close()
 
-    usuarios = conn.execute('SELECT matricula, nome, perfil FROM usuarios').fetchall()
-    conn.close()
-    return render_template('cadastro_usuarios.html', usuarios=usuarios, mensagem=mensagem)
+        # Envio pelo formulário assíncrono: devolve apenas a linha nova
+        if requisicao_parcial():
+            return jsonify({'mensagem': mensagem, 'linha': linha}), 200 if linha else 400
+
+    busca, pagina = parametros_listagem()
+    tabela = fragmento_tabela('usuarios', busca, pagina)
+    return render_template('cadastro_usuarios.html', tabela=tabela, listagem='usuarios', mensagem=mensagem)
 
 # Exclusão de Usuários (com verificação de dependências)
 @app.route('/excluir_usuario/<matricula>')
@@ -178,6 +352,7 @@ def excluir_usuario(matricula):
                 return redirect(url_for('cadastrar_usuario'))
             
             conn.execute('DELETE FROM usuarios WHERE matricula = ?', (matricula,))
+            incrementar_versao_tabela(conn, 'usuarios')
             conn.commit()
         
         flash('Usuário excluído com sucesso.')
@@ -221,7 +396,10 @@ def editar_usuario(matricula):
                 SET nome = ?, perfil = ?, data_acao = ?, hora_acao = ?, usuario_acao = ?
                 WHERE matricula = ?
             ''', (nome, perfil, data_acao, hora_acao, responsavel, matricula))
- 
+        incrementar_versao_tabela(conn, 'usuarios')
+        conn.commit()
+        conn.close()
+
         flash('Usuário atualizado com sucesso.')
         return redirect(url_for('cadastrar_usuario'))
 
@@ -305,9 +483,40 @@ def painel_maquina(id_maquina):
     tempo_paradas = "1h 15m"
     tempo_medio_ciclos = "45 segundos"
     
-    conn.close()
+    # Estado que o terminal mostra ao operador: os eventos da fila local
+    # registram a transição pretendida a partir dele
+    atividade = conn.execute("""
+        SELECT * FROM atividades
+        WHERE id_maquina = ? AND status = 'Ativa'
+    """, (id_maquina,)).fetchone()
+    paradas_abertas = conn.execute("""
+        SELECT id_parada, tipo_parada FROM paradas
+        WHERE id_maquina = ? AND status = 'Ativa'
+    """, (id_maquina,)).fetchall()
+    estado_painel = {
+        'producao': {
+            'ativa': atividade is not None,
+            'id': atividade['id_atividade'] if atividade else None
+        },
+        'paradas': {p['tipo_parada']: p['id_parada'] for p in paradas_abertas}
+    }
     
+    # Alertas de lentidão mais recentes (registrados a cada ciclo informado)
+    alertas = conn.execute('''
+        SELECT * FROM alertas_lentidao
+        WHERE id_maquina = ?
+        ORDER BY id_alerta DESC
+        LIMIT 5
+    ''', (id_maquina,)).fetchall()
+    
+    conn.close()
+
     return render_template('painel_maquina.html', 
+                           id_maquina=id_maquina,
+                           atividade_ativa=atividade is not None,
+                           atividade=atividade,
+                           estado_painel=estado_painel,
+                           alertas=alertas,
                            maquina=maquina,
                            nome_operador=nome_operador,
                            estado_atual=estado_atual,
@@ -327,7 +536,6 @@ def cadastrar_maquina():
         return redirect(url_for('pagina_inicial'))
 
     mensagem = None
-    conn = get_db_connection()
 
     if request.method == 'POST':
         id_maquina = request.form.get('id_maquina', '').strip()
@@ -338,24 +546,34 @@ def cadastrar_maquina():
         meta_dia = request.form.get('meta_dia', '').strip()
         data_cadastro = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         responsavel = session.get('usuario_logado')
+        linha = None
 
         # Validação dos campos obrigatórios
         if not all([id_maquina, nome_maquina, setor, tipo_maquina, meta_hora, meta_dia]):
             mensagem = 'Preencha todos os campos obrigatórios.'
         else:
+            conn = get_db_connection()
             try:
                 conn.execute('''
                     INSERT INTO maquinas (id_maquina, nome_maquina, setor, meta_hora, meta_dia, tipo_maquina, data_cadastro, usuario_responsavel)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (id_maquina, nome_maquina, setor, meta_hora, meta_dia, tipo_maquina, data_cadastro, responsavel))
+                incrementar_versao_tabela(conn, 'maquinas')
                 conn.commit()
                 mensagem = 'Máquina cadastrada com sucesso!'
+                maquina = conn.execute('SELECT * FROM maquinas WHERE id_maquina = ?', (id_maquina,)).fetchone()
+                linha = render_template('linha_maquina.html', maquina=maquina)
             except sqlite3.IntegrityError:
                 mensagem = 'ID da máquina já cadastrada.'
+            conn.close()
 
-    maquinas = conn.execute('SELECT * FROM maquinas ORDER BY setor, nome_maquina').fetchall()
-    conn.close()
-    return render_template('cadastro_maquinas.html', maquinas=maquinas, mensagem=mensagem)
+        # Envio pelo formulário assíncrono: devolve apenas a linha nova
+        if requisicao_parcial():
+            return jsonify({'mensagem': mensagem, 'linha': linha}), 200 if linha else 400
+
+    busca, pagina = parametros_listagem()
+    tabela = fragmento_tabela('maquinas', busca, pagina)
+    return render_template('cadastro_maquinas.html', tabela=tabela, listagem='maquinas', mensagem=mensagem)
 
 # Editar Máquinas
 
@@ -388,6 +606,7 @@ def editar_maquina(id_maquina):
                 usuario_acao = ?
             WHERE id_maquina = ?
         ''', (nome, setor, meta_hora, meta_dia, tipo, data_acao, hora_acao, usuario_acao, id_maquina))
+        incrementar_versao_tabela(conn, 'maquinas')
         conn.commit()
         conn.close()
 
@@ -421,6 +640,7 @@ def excluir_maquina(id_maquina):
                 return redirect(url_for('cadastrar_maquina'))
             
             conn.execute('DELETE FROM maquinas WHERE id_maquina = ?', (id_maquina,))
+            incrementar_versao_tabela(conn, 'maquinas')
             conn.commit()
         
         flash('Máquina excluída com sucesso.')
@@ -429,6 +649,16 @@ def excluir_maquina(id_maquina):
     
     return redirect(url_for('cadastrar_maquina'))
 
+# Fragmentos das Listagens (paginação e busca sem recarregar a página)
+@app.route('/fragmento/<tabela>')
+@admin_required
+def fragmento_listagem(tabela):
+    if tabela not in LISTAGENS:
+        return '', 404
+
+    busca, pagina = parametros_listagem()
+    return fragmento_tabela(tabela, busca, pagina)
+
 # Controle de Produção
 
 @app.route('/controle_producao/<id_maquina>', methods=['POST'])
@@ -489,6 +719,127 @@ def controle_producao(id_maquina):
     flash(mensagem)
     return redirect(url_for('pagina_controle_maquina', id_maquina=id_maquina))
 
+# Registro de Ciclos
+# Cada ciclo concluído é informado pelo botão "Registrar Ciclo" do painel da
+# máquina, com a sessão do operador logado no terminal (mesma proteção das
+# demais ações do painel).
+
+@app.route('/registrar_ciclo/<id_maquina>', methods=['POST'])
+def registrar_ciclo(id_maquina):
+    if 'usuario_logado' not in session:
+        return redirect(url_for('login'))  # Proteção de sessão
+
+    ativo, atividade = atividade_ativa_maquina(id_maquina)
+    if not ativo:
+        return jsonify({'erro': 'Nenhuma atividade em andamento.'}), 409
+
+    conn = get_db_connection()
+    agora = datetime.now()
+    try:
+        # Trava de escrita antes de ler o snapshot: dois processos não contam o mesmo ciclo
+        conn.execute('BEGIN IMMEDIATE')
+
+        estado = carregar_estatisticas_ciclo(conn, id_maquina, atividade)
+        inicio_amostra = estado['ultimo_ciclo']
+        estado['ultimo_ciclo'] = agora
+
+        if inicio_amostra is None:
+            # Primeiro ciclo da atividade: apenas marca o início da medição
+            tempo_ciclo = None
+            amostra_descartada = True
+        else:
+            tempo_ciclo = (agora - inicio_amostra).total_seconds()
+
+            # Intervalo que cruza uma parada não representa um ciclo e é descartado.
+            # Só entram paradas ainda abertas ou encerradas depois do ciclo anterior.
+            data_amostra = inicio_amostra.date().isoformat()
+            hora_amostra = inicio_amostra.time().strftime('%H:%M:%S')
+            parada = conn.execute('''
+                SELECT 1 FROM paradas
+                WHERE id_maquina = ? AND status = 'Ativa'
+                UNION ALL
+                SELECT 1 FROM paradas
+                WHERE id_maquina = ? AND status = 'Encerrada' AND data_fim >= ?
+                  AND (data_fim > ? OR hora_fim > ?)
+                LIMIT 1
+            ''', (id_maquina, id_maquina, data_amostra, data_amostra, hora_amostra)).fetchone()
+            amostra_descartada = parada is not None
+
+        maquina = conn.execute('SELECT meta_hora FROM maquinas WHERE id_maquina = ?', (id_maquina,)).fetchone()
+        tempo_alvo = tempo_alvo_ciclo(maquina['meta_hora']) if maquina else None
+
+        novo_alerta = False
+        if not amostra_descartada:
+            atualizar_estatisticas_ciclo(estado, tempo_ciclo)
+
+            # Alerta apenas na transição, para não registrar um alerta por ciclo
+            if tempo_alvo and estado['ciclos'] >= MIN_CICLOS_ALERTA:
+                lento = estado['ewma'] > tempo_alvo * TOLERANCIA_LENTIDAO
+                if lento and not estado['em_alerta']:
+                    conn.execute('''
+                        INSERT INTO alertas_lentidao (id_maquina, id_atividade, data, hora, ewma_ciclo, tempo_alvo)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (
+                        id_maquina, estado['id_atividade'], agora.date().isoformat(),
+                        agora.time().strftime('%H:%M:%S'), estado['ewma'], tempo_alvo
+                    ))
+                    novo_alerta = True
+                estado['em_alerta'] = lento
+
+        conn.execute('''
+            UPDATE atividades SET ciclos_realizados = COALESCE(ciclos_realizados, 0) + 1
+            WHERE id_atividade = ?
+        ''', (estado['id_atividade'],))
+        gravar_estatisticas_ciclo(conn, id_maquina, estado)
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        if 'locked' not in str(e):
+            raise
+        return jsonify({'erro': 'Banco de dados ocupado.'}), 503
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return jsonify({
+        'ciclos': estado['ciclos'],
+        'tempo_ciclo': tempo_ciclo,
+        'amostra_descartada': amostra_descartada,
+        'media': estado['media'],
+        'desvio_padrao': desvio_padrao_ciclo(estado),
+        'ewma': estado['ewma'],
+        'tempo_alvo': tempo_alvo,
+        'ultimo_ciclo': estado['ultimo_ciclo'].strftime('%Y-%m-%d %H:%M:%S') if estado['ultimo_ciclo'] else None,
+        'em_alerta': estado['em_alerta'],
+        'novo_alerta': novo_alerta
+    })
+
+@app.route('/estatisticas_ciclo/<id_maquina>')
+def consultar_estatisticas_ciclo(id_maquina):
+    if 'usuario_logado' not in session:
+        return redirect(url_for('login'))
+
+    ativo, atividade = atividade_ativa_maquina(id_maquina)
+    if not ativo:
+        return jsonify({'erro': 'Nenhuma atividade em andamento.'}), 404
+
+    conn = get_db_connection()
+    estado = carregar_estatisticas_ciclo(conn, id_maquina, atividade)
+    maquina = conn.execute('SELECT meta_hora FROM maquinas WHERE id_maquina = ?', (id_maquina,)).fetchone()
+    conn.close()
+
+    return jsonify({
+        'ciclos': estado['ciclos'],
+        'media': estado['media'],
+        'desvio_padrao': desvio_padrao_ciclo(estado),
+        'ewma': estado['ewma'],
+        'tempo_alvo': tempo_alvo_ciclo(maquina['meta_hora']) if maquina else None,
+        'ultimo_ciclo': estado['ultimo_ciclo'].strftime('%Y-%m-%d %H:%M:%S') if estado['ultimo_ciclo'] else None,
+        'em_alerta': estado['em_alerta']
+    })
+
 @app.route('/controle_maquina/<id_maquina>')
 def pagina_controle_maquina(id_maquina):
     ativo, atividade = atividade_ativa_maquina(id_maquina)
@@ -512,27 +863,16 @@ def pagina_controle_maquina(id_maquina):
 
 # Ações da Produção
 
-# Ação Produção
-
-@app.route('/acao_producao/<id_maquina>', methods=['POST'])
-def acao_producao(id_maquina):
-    if 'usuario_logado' not in session:
-        return redirect(url_for('login'))  # Proteção de sessão
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def aplicar_acao_producao(cursor, id_maquina, operador, agora):
+    data = agora.date().isoformat()
+    hora = agora.time().strftime('%H:%M:%S')
 
     # Verifica se há uma atividade ativa
     atividade = cursor.execute("""
-        SELECT * FROM atividades 
+        SELECT * FROM atividades
         WHERE id_maquina = ? AND status = 'Ativa'
     """, (id_maquina,)).fetchone()
 
-    operador = session.get('usuario_logado')
-    agora = datetime.now()
-    data = agora.date().isoformat()
-    hora = agora.time().strftime('%H:%M:%S')
-
     if atividade:
         # ENCERRAR PRODUÇÃO
         id_atividade = atividade['id_atividade']
@@ -542,17 +882,17 @@ def acao_producao(id_maquina):
         tempo_total = (agora - dt_inicio).total_seconds()
 
         cursor.execute("""
-            UPDATE atividades SET 
-                data_fim = ?, 
-                hora_fim = ?, 
-                operador_fim = ?, 
+            UPDATE atividades SET
+                data_fim = ?,
+                hora_fim = ?,
+                operador_fim = ?,
                 status = 'Encerrada',
                 tempo_total = ?
             WHERE id_atividade = ?
         """, (data, hora, operador, tempo_total, id_atividade))
 
         cursor.execute("UPDATE maquinas SET status = 'Parada' WHERE id_maquina = ?", (id_maquina,))
-    
+
     else:
         # INICIAR PRODUÇÃO
         cursor.execute("""
@@ -563,29 +903,13 @@ def acao_producao(id_maquina):
 
         cursor.execute("UPDATE maquinas SET status = 'Em produção' WHERE id_maquina = ?", (id_maquina,))
 
-    conn.commit()
-    conn.close()
-    return '', 204
-
-# Ação Parada
-@app.route('/acao_parada/<id_maquina>', methods=['POST'])
-def acao_parada(id_maquina):
-    if 'usuario_logado' not in session:
-        return redirect(url_for('login'))  # Proteção de sessão
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    dados = request.get_json()
-    tipo_parada = dados.get('tipo')
-    operador = session.get('usuario_logado')
-    agora = datetime.now()
+def aplicar_acao_parada(cursor, id_maquina, tipo_parada, operador, agora):
     data = agora.date().isoformat()
     hora = agora.time().strftime('%H:%M:%S')
 
     # Verifica se já existe uma parada ativa desse tipo
     parada_ativa = cursor.execute("""
-        SELECT * FROM paradas 
+        SELECT * FROM paradas
         WHERE id_maquina = ? AND tipo_parada = ? AND status = 'Ativa'
     """, (id_maquina, tipo_parada)).fetchone()
 
@@ -598,21 +922,21 @@ def acao_parada(id_maquina):
         tempo_total = (agora - dt_inicio).total_seconds()
 
         cursor.execute("""
-            UPDATE paradas SET 
-                data_fim = ?, 
-                hora_fim = ?, 
-                operador_fim = ?, 
+            UPDATE paradas SET
+                data_fim = ?,
+                hora_fim = ?,
+                operador_fim = ?,
                 status = 'Encerrada',
                 tempo_total = ?
             WHERE id_parada = ?
         """, (data, hora, operador, tempo_total, id_parada))
 
         cursor.execute("UPDATE maquinas SET status = 'Parada' WHERE id_maquina = ?", (id_maquina,))
-    
+
     else:
         # INICIAR PARADA
         atividade = cursor.execute("""
-            SELECT id_atividade FROM atividades 
+            SELECT id_atividade FROM atividades
             WHERE id_maquina = ? AND status = 'Ativa'
         """, (id_maquina,)).fetchone()
 
@@ -626,10 +950,222 @@ def acao_parada(id_maquina):
 
         cursor.execute("UPDATE maquinas SET status = ? WHERE id_maquina = ?", (f'Em {tipo_parada}', id_maquina))
 
+# Ação Produção
+
+@app.route('/acao_producao/<id_maquina>', methods=['POST'])
+def acao_producao(id_maquina):
+    if 'usuario_logado' not in session:
+        return redirect(url_for('login'))  # Proteção de sessão
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    aplicar_acao_producao(cursor, id_maquina, session.get('usuario_logado'), datetime.now())
     conn.commit()
     conn.close()
     return '', 204
 
+# Ação Parada
+@app.route('/acao_parada/<id_maquina>', methods=['POST'])
+def acao_parada(id_maquina):
+    if 'usuario_logado' not in session:
+        return redirect(url_for('login'))  # Proteção de sessão
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    dados = request.get_json()
+    tipo_parada = dados.get('tipo')
+    aplicar_acao_parada(cursor, id_maquina, tipo_parada, session.get('usuario_logado'), datetime.now())
+    conn.commit()
+    conn.close()
+    return '', 204
+
+# Sincronização de Eventos dos Terminais
+# Os terminais guardam as ações numa fila local e a reenviam em lotes. Cada
+# evento traz o número de sequência, o horário original, o operador que apertou
+# o botão e a transição pretendida (iniciar/encerrar, com o registro que o painel
+# mostrava). Eventos que não correspondem mais ao estado da máquina são recusados.
+# O operador informado só é aceito se já usou o terminal com a própria sessão
+# (operadores_terminal); caso contrário o evento é creditado ao usuário logado.
+
+MAX_EVENTOS_LOTE = 100
+
+def registro_aberto(cursor, id_maquina, acao, tipo_parada):
+    if acao == 'producao':
+        return cursor.execute("""
+            SELECT id_atividade AS id, data_inicio, hora_inicio FROM atividades
+            WHERE id_maquina = ? AND status = 'Ativa'
+        """, (id_maquina,)).fetchone()
+    return cursor.execute("""
+        SELECT id_parada AS id, data_inicio, hora_inicio FROM paradas
+        WHERE id_maquina = ? AND tipo_parada = ? AND status = 'Ativa'
+    """, (id_maquina, tipo_parada)).fetchone()
+
+def ultimo_encerramento(cursor, id_maquina, acao, tipo_parada):
+    if acao == 'producao':
+        registro = cursor.execute("""
+            SELECT data_fim, hora_fim FROM atividades
+            WHERE id_maquina = ? AND data_fim IS NOT NULL
+            ORDER BY data_fim DESC, hora_fim DESC LIMIT 1
+        """, (id_maquina,)).fetchone()
+    else:
+        registro = cursor.execute("""
+            SELECT data_fim, hora_fim FROM paradas
+            WHERE id_maquina = ? AND tipo_parada = ? AND status = 'Encerrada'
+            ORDER BY data_fim DESC, hora_fim DESC LIMIT 1
+        """, (id_maquina, tipo_parada)).fetchone()
+    if not registro:
+        return None
+    return datetime.strptime(f"{registro['data_fim']} {registro['hora_fim']}", "%Y-%m-%d %H:%M:%S")
+
+def operador_evento(cursor, id_terminal, evento):
+    # Matrícula diferente da sessão só vale se já operou este terminal logada
+    informado = evento.get('operador')
+    if informado == session['usuario_logado']:
+        return informado
+    if isinstance(informado, str) and cursor.execute('''
+        SELECT 1 FROM operadores_terminal WHERE id_terminal = ? AND matricula = ?
+    ''', (id_terminal, informado)).fetchone():
+        return informado
+    return session['usuario_logado']
+
+def texto_evento(evento, campo):
+    valor = evento.get(campo)
+    return None if valor is None else str(valor)
+
+def aplicar_evento_terminal(cursor, evento, momento, operador):
+    id_maquina = evento.get('maquina')
+    acao = evento.get('acao')
+    tipo_parada = evento.get('tipo')
+    transicao = evento.get('transicao')
+
+    if not isinstance(id_maquina, str) or not id_maquina or momento is None \
+            or acao not in ('producao', 'parada') or transicao not in ('iniciar', 'encerrar') \
+            or (acao == 'parada' and (not isinstance(tipo_parada, str) or not tipo_parada)) \
+            or not isinstance(evento.get('registro'), (int, str, type(None))):
+        return False
+
+    aberto = registro_aberto(cursor, id_maquina, acao, tipo_parada)
+    if transicao == 'iniciar':
+        if aberto:
+            return False
+        # Início anterior ao último encerramento criaria registros sobrepostos
+        encerramento = ultimo_encerramento(cursor, id_maquina, acao, tipo_parada)
+        if encerramento and momento < encerramento:
+            return False
+    else:
+        if not aberto:
+            return False
+        if evento.get('registro') is not None and int(evento['registro']) != aberto['id']:
+            return False
+        inicio = datetime.strptime(f"{aberto['data_inicio']} {aberto['hora_inicio']}", "%Y-%m-%d %H:%M:%S")
+        if momento < inicio:
+            return False
+
+    if acao == 'producao':
+        aplicar_acao_producao(cursor, id_maquina, operador, momento)
+    else:
+        aplicar_acao_parada(cursor, id_maquina, tipo_parada, operador, momento)
+    return True
+
+@app.route('/sincronizar_eventos', methods=['POST'])
+def sincronizar_eventos():
+    if 'usuario_logado' not in session:
+        return jsonify({'erro': 'Sessão expirada.'}), 401
+
+    dados = request.get_json(silent=True) or {}
+    id_terminal = str(dados.get('terminal') or '').strip()
+    eventos = dados.get('eventos')
+    if not id_terminal or not isinstance(eventos, list):
+        return jsonify({'erro': 'Lote de eventos inválido.'}), 400
+
+    lote = []
+    for evento in eventos[:MAX_EVENTOS_LOTE]:
+        try:
+            lote.append((int(evento['seq']), evento))
+        except (KeyError, TypeError, ValueError):
+            continue  # sem sequência não há como confirmar o evento
+    lote.sort(key=lambda item: item[0])
+
+    agora = datetime.now()
+    aplicados = 0
+    rejeitados = []
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Trava de escrita desde o início: lotes simultâneos do mesmo terminal não se sobrepõem
+        cursor.execute('BEGIN IMMEDIATE')
+        ultimo_seq = cursor.execute('''
+            SELECT MAX(seq) AS seq FROM eventos_terminal WHERE id_terminal = ?
+        ''', (id_terminal,)).fetchone()['seq'] or 0
+
+        # Usuário logado passa a poder ser informado nos eventos deste terminal
+        cursor.execute('''
+            INSERT OR IGNORE INTO operadores_terminal (id_terminal, matricula, data_registro)
+            VALUES (?, ?, ?)
+        ''', (id_terminal, session['usuario_logado'], agora.strftime('%Y-%m-%d %H:%M:%S')))
+
+        for seq, evento in lote:
+            if seq <= ultimo_seq:
+                continue  # já processado em um envio anterior
+
+            try:
+                momento = datetime.strptime(str(evento.get('momento')), '%Y-%m-%d %H:%M:%S')
+                # Relógio do terminal adiantado não pode gerar registros no futuro
+                momento = min(momento, agora)
+            except ValueError:
+                momento = None
+
+            operador = operador_evento(cursor, id_terminal, evento)
+
+            # Cada evento tem seu savepoint: um evento com dados inválidos é
+            # recusado sem desfazer os demais nem travar a fila do terminal
+            cursor.execute('SAVEPOINT evento')
+            try:
+                aplicado = aplicar_evento_terminal(cursor, evento, momento, operador)
+            except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError, ValueError, TypeError):
+                cursor.execute('ROLLBACK TO evento')
+                aplicado = False
+            cursor.execute('RELEASE evento')
+
+            cursor.execute('''
+                INSERT INTO eventos_terminal (
+                    id_terminal, seq, id_maquina, acao, tipo_parada, transicao, id_registro,
+                    data_evento, hora_evento, operador, operador_informado, usuario_sessao,
+                    data_recebimento, situacao
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                id_terminal, seq,
+                *(texto_evento(evento, campo) for campo in ('maquina', 'acao', 'tipo', 'transicao', 'registro')),
+                momento.date().isoformat() if momento else None,
+                momento.time().strftime('%H:%M:%S') if momento else None,
+                operador, texto_evento(evento, 'operador'), session['usuario_logado'],
+                agora.strftime('%Y-%m-%d %H:%M:%S'),
+                'Aplicado' if aplicado else 'Rejeitado'
+            ))
+
+            if aplicado:
+                aplicados += 1
+            else:
+                rejeitados.append(seq)
+            ultimo_seq = seq
+
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        if 'locked' not in str(e):
+            raise
+        # Banco travado por outra escrita: o terminal mantém a fila e tenta de novo
+        return jsonify({'erro': 'Banco de dados ocupado.'}), 503
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return jsonify({'ultimo_seq': ultimo_seq, 'aplicados': aplicados, 'rejeitados': rejeitados})
+
 
 
 if __name__ == '__main__':
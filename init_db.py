@@ -43,6 +43,80 @@ CREATE TABLE IF NOT EXISTS maquinas (
 )
 ''')
 
+conn.execute('''
+CREATE TABLE IF NOT EXISTS estatisticas_ciclo (
+    id_maquina TEXT PRIMARY KEY,
+    id_atividade INTEGER,
+    ciclos INTEGER,
+    media REAL,
+    m2 REAL,
+    ewma REAL,
+    ultimo_ciclo TEXT,
+    em_alerta INTEGER
+)
+''')
+
+conn.execute('''
+CREATE TABLE IF NOT EXISTS alertas_lentidao (
+    id_alerta INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_maquina TEXT,
+    id_atividade INTEGER,
+    data TEXT,
+    hora TEXT,
+    ewma_ciclo REAL,
+    tempo_alvo REAL
+)
+''')
+
+# Índice das paradas por máquina e situação (paradas abertas ou encerradas
+# depois do último ciclo). A tabela de paradas é criada fora deste script.
+if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'paradas'").fetchone():
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_paradas_maquina_status
+    ON paradas (id_maquina, status, data_fim, hora_fim)
+    ''')
+
+conn.execute('''
+CREATE TABLE IF NOT EXISTS versoes_tabelas (
+    tabela TEXT PRIMARY KEY,
+    versao INTEGER NOT NULL
+)
+''')
+
+conn.executemany(
+    'INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES (?, 0)',
+    [('maquinas',), ('usuarios',)]
+)
+
+conn.execute('''
+CREATE TABLE IF NOT EXISTS eventos_terminal (
+    id_terminal TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    id_maquina TEXT,
+    acao TEXT,
+    tipo_parada TEXT,
+    transicao TEXT,
+    id_registro TEXT,
+    data_evento TEXT,
+    hora_evento TEXT,
+    operador TEXT,
+    operador_informado TEXT,
+    usuario_sessao TEXT,
+    data_recebimento TEXT,
+    situacao TEXT,
+    PRIMARY KEY (id_terminal, seq)
+)
+''')
+
+conn.execute('''
+CREATE TABLE IF NOT EXISTS operadores_terminal (
+    id_terminal TEXT NOT NULL,
+    matricula TEXT NOT NULL,
+    data_registro TEXT,
+    PRIMARY KEY (id_terminal, matricula)
+)
+''')
+
 # Inserção de um usuário administrador padrão (opcional)
 try:
     conn.execute('''